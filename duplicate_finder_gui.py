@@ -18,15 +18,22 @@ Duplicate & Triplicate Finder (Tkinter) — v2.6
 import os
 import sys
 import csv
+import mmap
+import multiprocessing
 import fnmatch
 import time
 import hashlib
+import itertools
+import queue
+import re
 import shutil
+import sqlite3
+import subprocess
 import threading
-from dataclasses import dataclass
+from array import array
 from datetime import datetime
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Dict, Tuple, Optional
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, NamedTuple, Tuple, Optional
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
@@ -44,6 +51,19 @@ if sys.platform.startswith("win"):
     except Exception:
         pass
 
+# ---- NumPy (опционально): группировка по размеру, расстояния Хэмминга ----
+try:
+    import numpy as np  # приходит вместе с imagehash
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+
+try:
+    import numba  # опционально, параллельный перебор пар для больших наборов хешей
+    HAS_NUMBA = HAS_NUMPY
+except Exception:
+    HAS_NUMBA = False
+
 # ---- Опциональные зависимости для перцептивных хешей ----
 try:
     from PIL import Image
@@ -58,12 +78,52 @@ try:
 except Exception:
     HAS_CV2 = False
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_GRAY  # libjpeg-turbo, опционально для JPEG
+    _TURBOJPEG = TurboJPEG()
+    HAS_TURBOJPEG = True
+except Exception:
+    HAS_TURBOJPEG = False
+
+try:
+    import xxhash  # опционально, быстрее blake2b для префикс-фильтра
+    HAS_XXHASH = True
+except Exception:
+    HAS_XXHASH = False
+
+# spawn на всех ОС: дочерний процесс не наследует состояние Tk и потоков окна
+_MP = multiprocessing.get_context("spawn")
+
 APP_TITLE = "Duplicate & Triplicate Finder — v2.6"
 DEFAULT_QUARANTINE_ROOT = os.path.join(os.path.expanduser("~"), "Duplicate_Quarantine")
+HASH_CACHE_NAME = ".hashcache.db"  # кеш хешей в корне карантина
 HASH_ALGO = "sha256"
 READ_BLOCK = 1024 * 1024  # 1 MiB
+PREFIX_BYTES = 64 * 1024  # объём начала файла для быстрого префикс-фильтра
+MMAP_MIN_SIZE = 128 * 1024  # файлы меньше читаются через read(): mmap дороже
+SMALL_FILE_MAX = 256 * 1024  # файлы не больше этого пул процессов хеширует пачками
+SMALL_FILE_BATCH = 16  # файлов в одной задаче пула
+
+LSH_MIN_BAND_BITS = 4  # полосы уже этого — LSH вырождается, считаем все пары
+# LSH выгоден, только пока кандидатов мало: проверка кандидата в разы дороже, чем пара
+# в плиточном переборе, а все кандидаты держатся в памяти одновременно
+LSH_MAX_CANDIDATE_SHARE = 1 / 256  # доля от всех N·(N-1)/2 пар
+LSH_MAX_CANDIDATES = 2_000_000  # абсолютный потолок (~125 МБ на индексы кандидатов)
+NUMBA_MIN_HASHES = 4096  # с этого размера полный перебор пар идёт через ядро Numba
+NUMBA_TILE = 4096  # сторона квадратного тайла пар (i, j) в ядре Numba
+# Ядро Numba проверяет пару ещё дешевле (и на всех ядрах) — LSH оставляем только при очень малой доле кандидатов
+LSH_MAX_CANDIDATE_SHARE_NUMBA = 1 / 2048
+UNDO_CHUNK_ROWS = 10000  # строк журнала на одну порцию отката
+
+GUI_DRAIN_MS = 50  # период разбора очереди сообщений сканера
+GUI_GROUPS_PER_TICK = 100  # групп за один проход, чтобы окно не подвисало
+GUI_MESSAGES_PER_TICK = 1000  # сообщений любого вида за один проход
+GUI_INSERT_CHUNK = 500  # строк Treeview за один after_idle
+PROGRESS_INTERVAL_S = 0.1  # сканер шлёт прогресс не чаще этого
+OPEN_DEBOUNCE_S = 1.0  # повторное открытие того же пути раньше этого срока игнорируется
 
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff", ".webp"}
+JPEG_EXTS = {".jpg", ".jpeg"}
 VIDEO_EXTS = {".mp4", ".mov", ".avi", ".mkv", ".wmv", ".m4v"}
 
 # ---------- Вспомогательные ----------
@@ -79,14 +139,6 @@ def human_size(num: int) -> str:
     return f"{n:.1f}ИБ"
 
 
-def file_hash(path: str, algo: str = HASH_ALGO, block_size: int = READ_BLOCK) -> str:
-    h = hashlib.new(algo)
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(block_size), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-
 def folder_ctime(path: str) -> float:
     try:
         return os.path.getctime(path)
@@ -104,15 +156,144 @@ def safe_relpath(path: str, start: str) -> str:
 def ext_of(path: str) -> str:
     return os.path.splitext(path)[1].lower()
 
+
+def compile_masks(masks: List[str]):
+    """Объединяет glob-маски в одно регулярное выражение (None, если масок нет).
+
+    Регистр учитывается так же, как в fnmatch.fnmatch: на Windows — без учёта.
+    """
+    if not masks:
+        return None
+    flags = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+    return re.compile("|".join(f"(?:{fnmatch.translate(m)})" for m in masks), flags)
+
+# ---------- Хеширование файлов ----------
+
+class _Sha256Backend:
+    """Фабрика объектов SHA-256; выбирается один раз при импорте."""
+
+    def __init__(self, name: str, factory):
+        self.name = name
+        self.new = factory
+
+
+def _pick_sha256_impl() -> _Sha256Backend:
+    # OpenSSL-сборка hashlib сама выбирает SHA-NI/AVX2 по CPUID; флаг
+    # usedforsecurity=False (3.9+) разрешает хеш и в FIPS-режиме (мы лишь сверяем содержимое).
+    try:
+        hashlib.new("sha256", usedforsecurity=False)
+        return _Sha256Backend("openssl", lambda: hashlib.new("sha256", usedforsecurity=False))
+    except (TypeError, ValueError):
+        return _Sha256Backend("hashlib", hashlib.sha256)
+
+
+_SHA256_IMPL = _pick_sha256_impl()
+
+
+def file_hash(path: str, algo: str = HASH_ALGO, block_size: int = READ_BLOCK) -> str:
+    h = _SHA256_IMPL.new() if algo == "sha256" else hashlib.new(algo)
+    with open(path, "rb", buffering=0) as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            # Крупные файлы — через mmap: страницы кеша отдаются хешу без копирования
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mm)
+                try:
+                    for i in range(0, len(mm), block_size):
+                        h.update(view[i:i + block_size])
+                finally:
+                    view.release()
+            return h.hexdigest()
+        # Мелкие — в один переиспользуемый буфер, memoryview без копий
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def pair_digest(a: str, b: str, block_size: int = READ_BLOCK) -> Optional[str]:
+    """Побайтно сравнивает два файла; при совпадении возвращает SHA-256 содержимого.
+
+    Сравнение обрывается на первом различающемся блоке, а хеш считается попутно
+    по блокам первого файла — второй файл не хешируется вовсе.
+    """
+    h = _SHA256_IMPL.new()
+    with open(a, "rb", buffering=0) as fa, open(b, "rb", buffering=0) as fb:
+        size = os.fstat(fa.fileno()).st_size
+        if size != os.fstat(fb.fileno()).st_size:
+            return None
+        if size < MMAP_MIN_SIZE:
+            da, db = fa.read(), fb.read()
+            if da != db:
+                return None
+            h.update(da)
+            return h.hexdigest()
+        with mmap.mmap(fa.fileno(), 0, access=mmap.ACCESS_READ) as ma, \
+                mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) as mb:
+            for i in range(0, size, block_size):
+                chunk = ma[i:i + block_size]
+                if chunk != mb[i:i + block_size]:  # сравнение bytes — это memcmp
+                    return None
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def prefix_hash(path: str, size: int = PREFIX_BYTES) -> bytes:
+    """Короткий некриптографический хеш первых size байт файла."""
+    with open(path, "rb") as f:
+        data = f.read(size)
+    if HAS_XXHASH:
+        return xxhash.xxh3_64(data).digest()
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+# Какой алгоритм даёт prefix_hash в этой установке: префиксы в кеше хешей помечаются им
+PREFIX_ALGO = "xxh3_64" if HAS_XXHASH else "blake2b-8"
+
+def _same_size_runs(sizes: "array[int]"):
+    """Пары (размер, индексы файлов) для размеров, встречающихся 2+ раз."""
+    if HAS_NUMPY:
+        arr = np.frombuffer(sizes, dtype=np.int64) if len(sizes) else np.empty(0, dtype=np.int64)
+        order = np.argsort(arr, kind="stable")
+        sorted_sizes = arr[order]
+        starts = np.flatnonzero(np.r_[True, sorted_sizes[1:] != sorted_sizes[:-1]])
+        lengths = np.diff(np.r_[starts, len(arr)])
+        multi = lengths >= 2
+        for st, m in zip(starts[multi].tolist(), lengths[multi].tolist()):
+            yield int(sorted_sizes[st]), order[st:st + m].tolist()
+        return
+    order = sorted(range(len(sizes)), key=sizes.__getitem__)
+    for size_val, run in itertools.groupby(order, key=sizes.__getitem__):
+        idx = list(run)
+        if len(idx) >= 2:
+            yield size_val, idx
+
 # ---------- Перцептивные хеши (опционально) ----------
 
+def _load_for_hash(path: str):
+    # JPEG через libjpeg-turbo (SIMD) сразу в оттенках серого — хеши всё равно
+    # считаются по яркости; остальное — через Pillow
+    if HAS_TURBOJPEG and ext_of(path) in JPEG_EXTS:
+        try:
+            with open(path, "rb") as f:
+                gray = _TURBOJPEG.decode(f.read(), pixel_format=TJPF_GRAY)
+            return Image.fromarray(gray[:, :, 0])
+        except Exception:
+            pass  # например, CMYK-JPEG: turbo не даёт серый, Pillow справится
+    with Image.open(path) as im:
+        return im.convert("RGB")
+
+
 def ahash_image(path: str):
     if not HAS_IMAGEHASH:
         return None
     try:
-        with Image.open(path) as im:
-            im = im.convert("RGB")
-            return imagehash.average_hash(im)
+        return imagehash.average_hash(_load_for_hash(path))
     except Exception:
         return None
 
@@ -121,9 +302,7 @@ def phash_image(path: str):
     if not HAS_IMAGEHASH:
         return None
     try:
-        with Image.open(path) as im:
-            im = im.convert("RGB")
-            return imagehash.phash(im)
+        return imagehash.phash(_load_for_hash(path))
     except Exception:
         return None
 
@@ -148,6 +327,150 @@ def ahash_video_center_frame(path: str):
     except Exception:
         return None
 
+
+def _hash_to_u64(hv) -> int:
+    """64-битный ImageHash (hash_size=8) -> беззнаковое число, биты по порядку str(hv)."""
+    return int.from_bytes(np.packbits(hv.hash.ravel()).tobytes(), "big")
+
+
+def _popcount64(x):
+    """Число единичных бит в каждом элементе массива uint64."""
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0+
+        return np.bitwise_count(x)
+    bits = np.unpackbits(np.ascontiguousarray(x).view(np.uint8), axis=-1)
+    return bits.reshape(x.shape + (64,)).sum(axis=-1)
+
+
+if HAS_NUMBA:
+    @numba.njit(inline="always")
+    def _popcount_u64(x):
+        # SWAR-подсчёт; LLVM распознаёт шаблон и выдаёт одну инструкцию popcnt
+        x = x - ((x >> numba.uint64(1)) & numba.uint64(0x5555555555555555))
+        x = (x & numba.uint64(0x3333333333333333)) + ((x >> numba.uint64(2)) & numba.uint64(0x3333333333333333))
+        x = (x + (x >> numba.uint64(4))) & numba.uint64(0x0F0F0F0F0F0F0F0F)
+        return (x * numba.uint64(0x0101010101010101)) >> numba.uint64(56)
+
+    @numba.njit(parallel=True, boundscheck=False, cache=True)
+    def _pairs_within_numba(h, thr, tile):
+        """Пары (i < j) с popcount(h[i] ^ h[j]) <= thr: два прохода по тайлам tile×tile
+        (подсчёт, затем запись), строки тайлов распределяются по ядрам через prange."""
+        n = h.shape[0]
+        n_tiles = (n + tile - 1) // tile
+        counts = np.zeros(n, dtype=np.int64)
+        for t in numba.prange(n_tiles):
+            i0, i1 = t * tile, min(n, (t + 1) * tile)
+            for j0 in range(i0, n, tile):
+                j1 = min(n, j0 + tile)
+                for i in range(i0, i1):
+                    hi = h[i]
+                    c = 0
+                    for j in range(max(i + 1, j0), j1):
+                        if _popcount_u64(hi ^ h[j]) <= thr:
+                            c += 1
+                    counts[i] += c
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        out_i = np.empty(offsets[n], dtype=np.intp)
+        out_j = np.empty(offsets[n], dtype=np.intp)
+        for t in numba.prange(n_tiles):
+            i0, i1 = t * tile, min(n, (t + 1) * tile)
+            for j0 in range(i0, n, tile):
+                j1 = min(n, j0 + tile)
+                for i in range(i0, i1):
+                    hi = h[i]
+                    pos = offsets[i]
+                    for j in range(max(i + 1, j0), j1):
+                        if _popcount_u64(hi ^ h[j]) <= thr:
+                            out_i[pos] = i
+                            out_j[pos] = j
+                            pos += 1
+                    offsets[i] = pos
+        return out_i, out_j
+
+
+def _near_pairs_bruteforce(hashes, thr: int):
+    """Все пары (i < j) с расстоянием Хэмминга <= thr; матрица считается полосами строк."""
+    n = len(hashes)
+    if HAS_NUMBA and n >= NUMBA_MIN_HASHES:
+        # Без промежуточной XOR-матрицы и на всех ядрах
+        return _pairs_within_numba(hashes, thr, NUMBA_TILE)
+    tile = max(1, (1 << 22) // max(n, 1))  # ~32 МБ на полосу XOR-матрицы
+    out_i, out_j = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)]
+    for start in range(0, n, tile):
+        block = hashes[start:start + tile, None] ^ hashes[None, start:]
+        ii, jj = np.nonzero(_popcount64(block) <= thr)
+        ii += start
+        jj += start
+        mask = ii < jj
+        out_i.append(ii[mask])
+        out_j.append(jj[mask])
+    return np.concatenate(out_i), np.concatenate(out_j)
+
+
+def _near_pairs(hashes, thr: int):
+    """Пары индексов (i < j) 64-битных хешей с расстоянием Хэмминга <= thr.
+
+    Кандидаты отбираются LSH: хеш делится на k = max(4, thr + 1) полос, и пара
+    с расстоянием <= thr по принципу Дирихле совпадает хотя бы в одной полосе —
+    пропусков нет. Число кандидатов (сумма m·(m-1)/2 по корзинам полос) считается
+    заранее; если их слишком много или полосы слишком узкие, выгоднее плиточный
+    полный перебор — он не держит кандидатов в памяти.
+    """
+    n = len(hashes)
+    bands = max(4, thr + 1)
+    if 64 // bands < LSH_MIN_BAND_BITS:
+        return _near_pairs_bruteforce(hashes, thr)
+    band_runs = []
+    n_cand = 0
+    for b in range(bands):
+        lo, hi = 64 * b // bands, 64 * (b + 1) // bands
+        keys = (hashes >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        lengths = np.diff(np.r_[starts, n])
+        multi = lengths >= 2
+        starts, lengths = starts[multi], lengths[multi]
+        n_cand += int((lengths * (lengths - 1) // 2).sum())
+        band_runs.append((order, starts, lengths))
+    use_numba = HAS_NUMBA and n >= NUMBA_MIN_HASHES
+    share = LSH_MAX_CANDIDATE_SHARE_NUMBA if use_numba else LSH_MAX_CANDIDATE_SHARE
+    if n_cand > min(LSH_MAX_CANDIDATES, n * (n - 1) // 2 * share):
+        return _near_pairs_bruteforce(hashes, thr)
+    cand_i, cand_j = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)]
+    for order, starts, lengths in band_runs:
+        for st, m in zip(starts.tolist(), lengths.tolist()):
+            run = order[st:st + m]
+            a, c = np.triu_indices(m, 1)
+            cand_i.append(run[a])
+            cand_j.append(run[c])
+    i, j = np.concatenate(cand_i), np.concatenate(cand_j)
+    # Одна пара может совпасть в нескольких полосах — убираем повторы
+    pair_ids = np.unique(np.minimum(i, j).astype(np.int64) * n + np.maximum(i, j))
+    i, j = pair_ids // n, pair_ids % n
+    close = _popcount64(hashes[i] ^ hashes[j]) <= thr
+    return i[close], j[close]
+
+
+def _union_clusters(n: int, ii, jj) -> List[List[int]]:
+    """Объединяет индексы 0..n-1 по парам (ii[k], jj[k]); возвращает кластеры из 2+."""
+    parent = list(range(n))
+
+    def find(a: int) -> int:
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    for a, b in zip(ii.tolist(), jj.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+    clusters: Dict[int, List[int]] = {}
+    for k in range(n):
+        clusters.setdefault(find(k), []).append(k)
+    return [c for c in clusters.values() if len(c) >= 2]
+
 # ---------- Параллельное хеширование ----------
 
 def _worker_sha256(path: str) -> Tuple[str, Optional[str]]:
@@ -157,23 +480,137 @@ def _worker_sha256(path: str) -> Tuple[str, Optional[str]]:
     except Exception:
         return path, None
 
+
+def _worker_prefix_hash(path: str) -> Tuple[str, Optional[bytes]]:
+    """Возвращает (path, хеш префикса или None в случае ошибки)."""
+    try:
+        return path, prefix_hash(path)
+    except Exception:
+        return path, None
+
+
+def _worker_compare_pair(a: str, b: str) -> List[Tuple[str, Optional[str]]]:
+    """Сравнивает пару файлов; при совпадении обоим присваивается общий SHA-256."""
+    try:
+        hv = pair_digest(a, b)
+    except Exception:
+        hv = None
+    return [(a, hv), (b, hv)]
+
+
+def _worker_phash(path: str, metric: str) -> Tuple[str, Optional[int]]:
+    """Возвращает (path, перцептивный хеш как 64-битное число или None)."""
+    ext = ext_of(path)
+    if ext in IMAGE_EXTS:
+        hv = phash_image(path) if metric == "phash" else ahash_image(path)
+    elif ext in VIDEO_EXTS:
+        hv = ahash_video_center_frame(path)
+    else:
+        hv = None
+    return path, (None if hv is None else _hash_to_u64(hv))
+
+
+def _worker_sha256_batch(paths: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """Хеширует пачку мелких файлов за одну задачу пула (меньше IPC на файл)."""
+    return [_worker_sha256(p) for p in paths]
+
 # ---------- Структуры данных ----------
 
-@dataclass
-class Group:
+class Group(NamedTuple):
     hash: str
     size: int
     keep: str
-    others: List[str]
+    others: Tuple[str, ...]
     kind: str = "exact"  # "exact" | "perceptual"
+    others_sizes: Tuple[int, ...] = ()  # размеры others (известны сканеру)
+
+class _LazyBatch:
+    """Папка батча карантина, которая создаётся при первом обращении к path.
+
+    Если разбор ничего не перенёс, пустой батч на диске не появляется.
+    Обращаться можно из потоков пула разбора.
+    """
+
+    def __init__(self, create):
+        self._create = create
+        self._path: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            with self._lock:
+                if self._path is None:
+                    self._path = self._create()
+        return self._path
+
+    @property
+    def created(self) -> bool:
+        return self._path is not None
+
+
+# ---------- Кеш хешей ----------
+
+class HashCache:
+    """Кеш хешей на диске (SQLite): (dev, inode) -> размер, mtime, префикс, SHA-256.
+
+    Запись считается действительной, только если размер и mtime_ns файла
+    не изменились. Префикс берётся из кеша, только если он посчитан тем же
+    алгоритмом (PREFIX_ALGO), что и сейчас: иначе одинаковые файлы попали бы
+    в разные корзины. Используется из одного потока — потока-сканера.
+    """
+
+    SCHEMA_VERSION = 2  # 2: добавлена колонка prefix_algo
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            # Кеш старой схемы просто пересобирается
+            self.db.execute("DROP TABLE IF EXISTS hashes")
+            self.db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, "
+            "prefix BLOB, prefix_algo TEXT, sha256 TEXT, PRIMARY KEY (dev, ino))"
+        )
+        self.db.commit()
+
+    def lookup(self, st: os.stat_result) -> Tuple[Optional[bytes], Optional[str]]:
+        try:
+            row = self.db.execute(
+                "SELECT size, mtime_ns, prefix, prefix_algo, sha256 FROM hashes WHERE dev = ? AND ino = ?",
+                (st.st_dev, st.st_ino),
+            ).fetchone()
+        except (sqlite3.Error, OverflowError):
+            return None, None
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return None, None
+        prefix = row[2] if row[3] == PREFIX_ALGO else None
+        return prefix, row[4]
+
+    def store(self, entries):
+        """entries: итерируемое из (stat_result, префикс или None, SHA-256 или None)."""
+        rows = [(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, pv, PREFIX_ALGO if pv is not None else None, hv)
+                for st, pv, hv in entries]
+        try:
+            self.db.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+        except (sqlite3.Error, OverflowError):
+            pass
+
+    def close(self):
+        self.db.close()
 
-# ---------- Поток-сканер ----------
+# ---------- Сканер (выполняется в отдельном процессе) ----------
 
-class Scanner(threading.Thread):
+class Scanner:
     def __init__(
         self,
         root_folder: str,
-        stop_event: threading.Event,
+        stop_event,
         on_progress,
         on_group,
         on_done,
@@ -186,8 +623,9 @@ class Scanner(threading.Thread):
         perceptual_metric: str,
         perceptual_threshold: int,
         max_workers: int,
+        use_threads: Optional[bool] = None,
+        cache_path: Optional[str] = None,
     ):
-        super().__init__(daemon=True)
         self.root_folder = root_folder
         self.stop_event = stop_event
         self.on_progress = on_progress
@@ -195,6 +633,9 @@ class Scanner(threading.Thread):
         self.on_done = on_done
         self.include_masks = include_masks
         self.exclude_masks = exclude_masks
+        # Маска «*» пропускает всё — такой фильтр не нужен вовсе
+        self._include_re = None if "*" in include_masks else compile_masks(include_masks)
+        self._exclude_re = compile_masks(exclude_masks)
         self.include_exts = {e.lower().strip() for e in include_exts if e.strip()}
         self.exclude_exts = {e.lower().strip() for e in exclude_exts if e.strip()}
         self.min_size = min_size_bytes
@@ -202,146 +643,308 @@ class Scanner(threading.Thread):
         self.perc_metric = perceptual_metric
         self.perc_thr = perceptual_threshold
         self.max_workers = max_workers
-
-    def _pass_filters(self, path: str, size: int) -> bool:
-        if size < self.min_size:
-            return False
-        ext = ext_of(path)
+        # hashlib отпускает GIL, так что потоки масштабируются не хуже процессов,
+        # но без pickling/запуска интерпретаторов и с общим кешем страниц
+        if use_threads is None:
+            use_threads = max_workers <= (os.cpu_count() or 1)
+        self.use_threads = use_threads
+        self.cache_path = cache_path
+        # ctime родительских папок: одна и та же папка встречается во многих группах
+        self._dir_ctime: Dict[str, float] = {}
+        self._cache: Optional[HashCache] = None
+
+    def _pass_name(self, base: str) -> bool:
+        # Фильтры по имени — до stat(), они бесплатны
+        ext = ext_of(base)
         if self.include_exts and (ext not in self.include_exts):
             return False
         if self.exclude_exts and (ext in self.exclude_exts):
             return False
-        base = os.path.basename(path)
-        if self.include_masks:
-            ok = any(fnmatch.fnmatch(base, m) for m in self.include_masks)
-            if not ok:
-                return False
-        if self.exclude_masks:
-            if any(fnmatch.fnmatch(base, m) for m in self.exclude_masks):
-                return False
+        if self._include_re is not None and not self._include_re.match(base):
+            return False
+        if self._exclude_re is not None and self._exclude_re.match(base):
+            return False
         return True
 
-    def run(self):
-        t0 = time.time()
-        files: List[Tuple[str, int]] = []
-        for dirpath, dirnames, filenames in os.walk(self.root_folder):
+    def _folder_ctime(self, path: str) -> float:
+        v = self._dir_ctime.get(path)
+        if v is None:
+            v = self._dir_ctime[path] = folder_ctime(path)
+        return v
+
+    def _walk(self):
+        """Обход дерева через os.scandir: (путь, stat_result) подходящих файлов.
+
+        Тип берётся из DirEntry без лишних stat(), размер — одним entry.stat()
+        (на Windows — вообще без системного вызова). Ссылки не разыменовываются.
+        stat_result отдаётся целиком: на POSIX в нём уже есть dev/inode/mtime для кеша.
+        """
+        stack = [self.root_folder]
+        while stack:
             if self.stop_event.is_set():
-                break
-            for name in filenames:
-                full = os.path.join(dirpath, name)
-                try:
-                    if os.path.islink(full):
-                        continue
-                    st = os.stat(full)
-                    if not os.path.isfile(full):
+                return
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False) and self._pass_name(entry.name):
+                            st = entry.stat(follow_symlinks=False)
+                            if st.st_size >= self.min_size:
+                                yield entry.path, st
+                    except OSError:
                         continue
-                    if self._pass_filters(full, st.st_size):
-                        files.append((full, st.st_size))
-                except Exception:
+
+    def _emit_exact(self, size_val: int, by_hash: Dict[str, List[str]]):
+        # Точные дубликаты: и хэш, и имя файла совпадают
+        for hval, same in by_hash.items():
+            if len(same) < 2:
+                continue
+            by_name: Dict[str, List[str]] = {}
+            for p in same:
+                name_key = os.path.basename(p).lower()
+                by_name.setdefault(name_key, []).append(p)
+            for _, same_name in by_name.items():
+                if len(same_name) < 2:
                     continue
+                keep_path = min(same_name, key=lambda p: self._folder_ctime(os.path.dirname(p)))
+                others = tuple(sorted([p for p in same_name if p != keep_path]))
+                self.on_group(
+                    Group(hash=hval, size=size_val, keep=keep_path, others=others, kind="exact",
+                          others_sizes=(size_val,) * len(others))
+                )
+
+    def _find_exact(self, ex, size_groups: List[Tuple[int, List[str]]], candidates: int,
+                    walk_stats: Dict[str, os.stat_result]):
+        processed = 0
+        last_progress = 0.0
+        # Все группы размеров уходят в пул сразу, и медленные файлы одной
+        # группы перекрываются быстрыми файлами других.
+        # tags: задача -> (стадия, размер); outstanding: размер -> незавершённых задач
+        tags: Dict[Future, Tuple[str, int]] = {}
+        outstanding: Dict[int, int] = {}
+        by_prefix: Dict[int, Dict[bytes, List[str]]] = {}
+        by_hash: Dict[int, Dict[str, List[str]]] = {}
+        done_q: "queue.Queue[Future]" = queue.Queue()
+        # Уже известные хеши (из кеша на диске или посчитанные сейчас);
+        # fresh — пути, чьи значения нужно записать в кеш
+        stats: Dict[str, os.stat_result] = {}
+        prefix_of: Dict[str, bytes] = {}
+        sha_of: Dict[str, str] = {}
+        fresh: set = set()
+
+        def submit(stage: str, size_val: int, fn, *args):
+            fut = ex.submit(fn, *args)
+            tags[fut] = (stage, size_val)
+            outstanding[size_val] = outstanding.get(size_val, 0) + 1
+            fut.add_done_callback(done_q.put)
+
+        def submit_full(size_val: int, lists: List[List[str]]):
+            # Пары сравниваются побайтно (обычно обрывается рано), остальные —
+            # полный SHA-256 по одному файлу на задачу; пачками мелкие файлы
+            # отдаются только пулу процессов, где каждая задача — это pickle и IPC
+            nonlocal processed
+            same_size = by_hash[size_val]
+            for lst in lists:
+                todo = []
+                for p in lst:
+                    hv = sha_of.get(p)
+                    if hv:
+                        same_size.setdefault(hv, []).append(p)
+                        processed += 1
+                    else:
+                        todo.append(p)
+                if len(lst) == 2 and len(todo) == 2:
+                    submit("full", size_val, _worker_compare_pair, *todo)
+                    continue
+                batched = not self.use_threads and size_val <= SMALL_FILE_MAX and len(todo) >= 4
+                step = SMALL_FILE_BATCH if batched else 1
+                for i in range(0, len(todo), step):
+                    submit("full", size_val, _worker_sha256_batch, todo[i:i + step])
+
+        def advance(size_val: int):
+            # Когда задачи размера закончились: после префиксов — полный проход
+            # по совпавшим, после полного прохода — выдача групп
+            nonlocal processed
+            if outstanding.get(size_val):
+                return
+            if size_val in by_prefix:
+                lists = []
+                for lst in by_prefix.pop(size_val).values():
+                    if len(lst) >= 2:
+                        lists.append(lst)
+                    else:
+                        processed += 1
+                submit_full(size_val, lists)
+                if outstanding.get(size_val):
+                    return
+            outstanding.pop(size_val, None)
+            self._emit_exact(size_val, by_hash.pop(size_val))
 
-        # Группировка по размеру
-        by_size: Dict[int, List[str]] = {}
-        for p, sz in files:
-            by_size.setdefault(sz, []).append(p)
+        try:
+            for size_val, paths in size_groups:
+                if self._cache is not None:
+                    for p in paths:
+                        # stat из обхода; os.stat — только если в нём нет inode
+                        # (DirEntry на Windows)
+                        st = walk_stats.get(p)
+                        if st is None or not st.st_ino:
+                            try:
+                                st = os.stat(p)
+                            except OSError:
+                                continue
+                        stats[p] = st
+                        pv, hv = self._cache.lookup(st)
+                        if pv is not None:
+                            prefix_of[p] = pv
+                        if hv:
+                            sha_of[p] = hv
+                by_hash[size_val] = {}
+                # Стадия 1: хеш первых PREFIX_BYTES отсекает различающиеся файлы,
+                # не читая их целиком (у мелких файлов префикс — это весь файл)
+                if size_val > PREFIX_BYTES:
+                    bucket = by_prefix[size_val] = {}
+                    for p in paths:
+                        pv = prefix_of.get(p)
+                        if pv is None:
+                            submit("prefix", size_val, _worker_prefix_hash, p)
+                        else:
+                            bucket.setdefault(pv, []).append(p)
+                else:
+                    submit_full(size_val, [paths])
+                advance(size_val)
+
+            while tags and not self.stop_event.is_set():
+                try:
+                    fut = done_q.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                stage, size_val = tags.pop(fut)
+                outstanding[size_val] -= 1
+                if stage == "prefix":
+                    p, pv = fut.result()
+                    if pv is None:
+                        processed += 1
+                    else:
+                        by_prefix[size_val].setdefault(pv, []).append(p)
+                        prefix_of[p] = pv
+                        fresh.add(p)
+                else:
+                    same_size = by_hash[size_val]
+                    for p, hv in fut.result():
+                        if hv:
+                            same_size.setdefault(hv, []).append(p)
+                            sha_of[p] = hv
+                            fresh.add(p)
+                        processed += 1
+                # Прогресс — не чаще PROGRESS_INTERVAL_S, чтобы не заваливать очередь окна
+                now = time.monotonic()
+                if now - last_progress >= PROGRESS_INTERVAL_S or not tags:
+                    last_progress = now
+                    self.on_progress(("progress", processed, candidates))
+                advance(size_val)
+        finally:
+            if self._cache is not None:
+                self._cache.store((stats[p], prefix_of.get(p), sha_of.get(p)) for p in fresh if p in stats)
+
+    def _find_similar(self, ex, files: List[str], file_sizes: "array[int]"):
+        # Декодирование и DCT — CPU-работа, раздаём её тому же пулу
+        size_of = {p: sz for p, sz in zip(files, file_sizes)
+                   if ext_of(p) in IMAGE_EXTS or (HAS_CV2 and ext_of(p) in VIDEO_EXTS)}
+        media = list(size_of)
+        # Хеши — сразу в плотный массив uint64 (8 байт на файл), пути — рядом
+        paths: List[str] = []
+        hashes = np.empty(len(media), dtype=np.uint64)
+        for p, hv in ex.map(_worker_phash, media, itertools.repeat(self.perc_metric), chunksize=16):
+            if self.stop_event.is_set():
+                return
+            if hv is not None:
+                hashes[len(paths)] = hv
+                paths.append(p)
+        hashes = hashes[:len(paths)]
+
+        # Кандидаты — через LSH по полосам бит, точное расстояние — только для них
+        ii, jj = _near_pairs(hashes, self.perc_thr)
+        for members in _union_clusters(len(paths), ii, jj):
+            keep_k = min(members, key=lambda k: self._folder_ctime(os.path.dirname(paths[k])))
+            keep_path = paths[keep_k]
+            others = tuple(sorted([paths[k] for k in members if k != keep_k]))
+            self.on_group(
+                Group(hash=f"perc:{int(hashes[keep_k]):016x}", size=size_of[keep_path], keep=keep_path,
+                      others=others, kind="perceptual", others_sizes=tuple(size_of[p] for p in others))
+            )
 
-        # Подсчет кандидатов для хеширования (только группы с >1 файлом)
-        candidates = sum(len(v) for v in by_size.values() if len(v) > 1)
+    def run(self):
+        t0 = time.time()
+        self._dir_ctime.clear()
+        # Список файлов — двумя параллельными массивами, без кортежа на файл
+        paths: List[str] = []
+        sizes = array("q")
+        # stat_result обхода нужен только кешу хешей — без кеша не храним
+        file_stats: Optional[List[os.stat_result]] = [] if self.cache_path else None
+        for p, st in self._walk():
+            paths.append(p)
+            sizes.append(st.st_size)
+            if file_stats is not None:
+                file_stats.append(st)
+
+        # Группы одинакового размера (только с >1 файлом) — кандидаты для хеширования
+        runs = list(_same_size_runs(sizes))
+        size_groups = [(sz, [paths[i] for i in idx]) for sz, idx in runs]
+        cand_stats: Dict[str, os.stat_result] = {}
+        if file_stats is not None:
+            cand_stats = {paths[i]: file_stats[i] for _, idx in runs for i in idx}
+            del file_stats
+        candidates = sum(len(lst) for _, lst in size_groups)
         self.on_progress(("start", candidates))
 
-        processed = 0
-        # Параллельное SHA256
-        for size_val, paths in by_size.items():
-            if self.stop_event.is_set():
-                break
-            if len(paths) < 2:
-                processed += len(paths)
-                self.on_progress(("progress", processed, candidates))
-                continue
+        perceptual = self.perceptual and HAS_IMAGEHASH
+        if not size_groups and not perceptual:
+            # Все размеры уникальны — пул и кеш не нужны
+            self.on_done(time.time() - t0)
+            return
 
-            by_hash: Dict[str, List[str]] = {}
-            with ProcessPoolExecutor(max_workers=self.max_workers) as ex:
-                futures = {ex.submit(_worker_sha256, p): p for p in paths}
-                for fut in as_completed(futures):
-                    if self.stop_event.is_set():
-                        break
-                    p, hv = fut.result()
-                    if hv:
-                        by_hash.setdefault(hv, []).append(p)
-                    processed += 1
-                    self.on_progress(("progress", processed, candidates))
+        if self.cache_path:
+            try:
+                self._cache = HashCache(self.cache_path)
+            except Exception:
+                self._cache = None
 
-            # Точные дубликаты: и хэш, и имя файла совпадают
-            for hval, same in by_hash.items():
-                if len(same) < 2:
-                    continue
-                by_name: Dict[str, List[str]] = {}
-                for p in same:
-                    name_key = os.path.basename(p).lower()
-                    by_name.setdefault(name_key, []).append(p)
-                for _, same_name in by_name.items():
-                    if len(same_name) < 2:
-                        continue
-                    keep_path = min(same_name, key=lambda p: folder_ctime(os.path.dirname(p)))
-                    others = sorted([p for p in same_name if p != keep_path])
-                    self.on_group(
-                        Group(hash=hval, size=size_val, keep=keep_path, others=others, kind="exact").__dict__
-                    )
-
-        # Перцептивная стадия (только если включена)
-        if self.perceptual and not self.stop_event.is_set():
-            perc_items: List[Tuple[str, str, Optional[object]]] = []  # (path, type, hashobj)
-            for p, _ in files:
-                ext = ext_of(p)
-                if ext in IMAGE_EXTS and HAS_IMAGEHASH:
-                    hv = phash_image(p) if self.perc_metric == "phash" else ahash_image(p)
-                    if hv is not None:
-                        perc_items.append((p, "img", hv))
-                elif ext in VIDEO_EXTS and HAS_CV2 and HAS_IMAGEHASH:
-                    hv = ahash_video_center_frame(p)
-                    if hv is not None:
-                        perc_items.append((p, "vid", hv))
-
-            buckets: Dict[str, List[Tuple[str, object]]] = {}
-            for p, _, hv in perc_items:
-                key = str(hv)[:8]
-                buckets.setdefault(key, []).append((p, hv))
-
-            seen = set()
-            for key, items in buckets.items():
-                n = len(items)
-                if n < 2:
-                    continue
-                for i in range(n):
-                    pi, hi = items[i]
-                    if pi in seen:
-                        continue
-                    cluster = [pi]
-                    for j in range(i + 1, n):
-                        pj, hj = items[j]
-                        if pj in seen:
-                            continue
-                        try:
-                            dist = hi - hj  # Hamming distance
-                        except Exception:
-                            continue
-                        if dist <= self.perc_thr:
-                            cluster.append(pj)
-                    if len(cluster) >= 2:
-                        keep_path = min(cluster, key=lambda p: folder_ctime(os.path.dirname(p)))
-                        others = sorted([p for p in cluster if p != keep_path])
-                        try:
-                            size_val = os.path.getsize(keep_path)
-                        except Exception:
-                            size_val = 0
-                        self.on_group(
-                            Group(hash=f"perc:{key}", size=size_val, keep=keep_path, others=others, kind="perceptual").__dict__
-                        )
-                        for p in cluster:
-                            seen.add(p)
+        # Один пул на весь скан: и точная, и перцептивная стадии
+        pool_cls = ThreadPoolExecutor if self.use_threads else ProcessPoolExecutor
+        ex = pool_cls(max_workers=self.max_workers)
+        try:
+            self._find_exact(ex, size_groups, candidates, cand_stats)
+            # Перцептивная стадия (только если включена)
+            if perceptual and not self.stop_event.is_set():
+                self._find_similar(ex, paths, sizes)
+        finally:
+            ex.shutdown(wait=True, cancel_futures=True)
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
 
         self.on_done(time.time() - t0)
 
+
+def run_scanner(params: dict, out_q, stop_event):
+    """Точка входа процесса-сканера: результаты уходят в out_q сообщениями
+    ("progress", msg), ("group", Group), ("done", elapsed).
+
+    Обход и фильтры держат GIL своего процесса, а не процесса с окном Tk.
+    """
+    Scanner(
+        stop_event=stop_event,
+        on_progress=lambda msg: out_q.put(("progress", msg)),
+        on_group=lambda group: out_q.put(("group", group)),
+        on_done=lambda elapsed: out_q.put(("done", elapsed)),
+        **params,
+    ).run()
+
 # ---------- GUI-приложение ----------
 
 class App(tk.Tk):
@@ -351,12 +954,28 @@ class App(tk.Tk):
         self.geometry("1250x780")
         self.minsize(1020, 620)
 
-        self.stop_event = threading.Event()
-        self.scanner: Optional[Scanner] = None
-        self.groups: List[dict] = []
+        self.stop_event = _MP.Event()
+        self.scanner: Optional[multiprocessing.Process] = None
+        self.groups: List[Group] = []
+
+        # Очередь сообщений процесса-сканера и периодический разбор её в потоке Tk
+        self._gui_queue = _MP.Queue()
+        self._drain_job: Optional[str] = None
+        # Отложенный текст статусной строки: применяется один раз, когда Tk простаивает
+        self._pending_status: Optional[str] = None
 
         # Соответствия keep -> [dups]
         self.keep_to_dups: Dict[str, List[str]] = {}
+        # Обратный индекс списка копий: путь -> позиции в others_list (без обхода списка через Tcl)
+        self._others_index: Dict[str, List[int]] = {}
+        self._others_count: int = 0
+        # Строки, ожидающие вставки в таблицы порциями: Treeview -> [(iid, values)]
+        self._bulk_pending: Dict[ttk.Treeview, List[Tuple[Optional[str], tuple]]] = {}
+        self._bulk_job: Optional[str] = None
+
+        # Открытие файлов/папок средствами ОС
+        self._open_cmd = self._pick_open_cmd()
+        self._recent_opens: Dict[str, float] = {}
 
         # Суммарный объём найденных копий
         self.dup_total_bytes: int = 0
@@ -373,6 +992,7 @@ class App(tk.Tk):
         self.include_exts_var = tk.StringVar(value="")  # пример: .jpg,.png,.mp4
         self.exclude_exts_var = tk.StringVar(value=".sys,.dll")
         self.workers_var = tk.IntVar(value=max(1, os.cpu_count() or 4))
+        self.io_workers_var = tk.IntVar(value=8)  # параллельные перемещения/удаления
 
         # Перцептивные
         self.perceptual_var = tk.BooleanVar(value=False)
@@ -381,8 +1001,20 @@ class App(tk.Tk):
 
         # Логирование
         self.last_batch_dir: Optional[str] = None
+        # Следующий номер суффикса для занятого имени: (путь, формат) -> n
+        self._name_counter: Dict[Tuple[str, str], int] = {}
+        # Файлы, перенесённые в текущий батч карантина: известно, что они есть, stat не нужен
+        self._known_present: set[str] = set()
+        # Папки внутри текущего батча, уже созданные для переносов
+        self._made_dirs: set[str] = set()
+        # Открытые журналы текущего батча (operations.csv и actions.log)
+        self._batch_dir: Optional[str] = None
+        self._batch_csv_f = self._batch_csv_w = self._batch_log_f = None
+        # (папка сканирования, карантин) -> на одном ли они томе
+        self._same_dev: Dict[Tuple[str, str], bool] = {}
 
         self._build_ui()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
     # --- UI ---
     def _build_ui(self):
@@ -430,6 +1062,8 @@ class App(tk.Tk):
 
         ttk.Label(filt, text="Потоки (процессы):").grid(row=0, column=6, sticky="e")
         ttk.Entry(filt, textvariable=self.workers_var, width=6).grid(row=0, column=7, sticky="w", padx=(4, 0))
+        ttk.Label(filt, text="Потоки разбора:").grid(row=1, column=6, sticky="e", pady=(6, 0))
+        ttk.Entry(filt, textvariable=self.io_workers_var, width=6).grid(row=1, column=7, sticky="w", padx=(4, 0), pady=(6, 0))
 
         for c in range(8):
             filt.columnconfigure(c, weight=1 if c in (3, 5) else 0)
@@ -605,9 +1239,19 @@ class App(tk.Tk):
             messagebox.showinfo("Выполняется", "Сканирование уже идёт.")
             return
 
-        # Сброс
+        # Сброс (и остатки сообщений прошлого скана)
+        if self._drain_job is not None:
+            self.after_cancel(self._drain_job)
+            self._drain_job = None
+        self._gui_queue = _MP.Queue()
         self.groups.clear()
         self.keep_to_dups.clear()
+        self._others_index.clear()
+        self._others_count = 0
+        if self._bulk_job is not None:
+            self.after_cancel(self._bulk_job)
+            self._bulk_job = None
+        self._bulk_pending.clear()
         self.dup_total_bytes = 0
         self.counted_dups.clear()
         self.total_waste_var.set("0 Б")
@@ -638,155 +1282,367 @@ class App(tk.Tk):
         min_size_b = int(max(0.0, self.min_size_mb_var.get()) * 1024 * 1024)
         workers = max(1, int(self.workers_var.get()))
 
-        def on_progress(msg):
-            kind = msg[0]
-            if kind == "start":
-                total = max(0, msg[1])
-                self.progress.config(maximum=100, value=0)
-                self.status_var.set(f"Хеширование кандидатов: 0 / {total} (0%)")
+        # --- запуск процесса-сканера ---
+        params = dict(
+            root_folder=root,
+            include_masks=include_masks,
+            exclude_masks=exclude_masks,
+            include_exts=include_exts,
+            exclude_exts=exclude_exts,
+            min_size_bytes=min_size_b,
+            perceptual=self.perceptual_var.get(),
+            perceptual_metric=self.perc_metric_var.get(),
+            perceptual_threshold=int(self.perc_thr_var.get()),
+            max_workers=workers,
+            cache_path=os.path.join(self.quarantine_root_var.get().strip() or DEFAULT_QUARANTINE_ROOT,
+                                    HASH_CACHE_NAME),
+        )
+        self.scanner = _MP.Process(target=run_scanner, args=(params, self._gui_queue, self.stop_event))
+        self.scanner.start()
+        self._drain_job = self.after(GUI_DRAIN_MS, self._drain_gui_queue)
+
+    # --- Сообщения сканера: поток-сканер только кладёт их в очередь, Tk разбирает ---
+    def _drain_gui_queue(self):
+        # Жив ли процесс — до разбора: если он уже завершился, всё отправленное им лежит в очереди
+        alive = self.scanner.is_alive()
+        groups: List[Group] = []
+        progress = None
+        done = None
+        # Ограничены и группы (дорогая вставка в таблицы), и общее число сообщений:
+        # иначе быстрый сканер не даёт очереди опустеть и поток Tk не выходит из цикла
+        for _ in range(GUI_MESSAGES_PER_TICK):
+            if len(groups) >= GUI_GROUPS_PER_TICK:
+                break
+            try:
+                kind, payload = self._gui_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "group":
+                groups.append(payload)
             elif kind == "progress":
-                done, total = msg[1], msg[2]
-                percent = 100 if total <= 0 else int((done / max(1, total)) * 100)
-                percent = 0 if percent < 0 else (100 if percent > 100 else percent)
-                self.progress.config(value=percent, maximum=100)
-                self.status_var.set(f"Хеширование кандидатов: {done} / {total} ({percent}%)")
-
-        def on_group(group: dict):
+                progress = payload  # важен только последний
+            else:
+                done = payload
+                break
+        if groups:
+            self._add_groups(groups)
+        if progress is not None:
+            self._show_progress(progress)
+        if done is None and not groups and progress is None and not alive:
+            # Очередь пуста, а процесс завершился без "done" — он упал
+            self._drain_job = None
+            self._finish_scan(None)
+            return
+        if done is not None:
+            self._drain_job = None
+            self._finish_scan(done)
+            return
+        self._drain_job = self.after(GUI_DRAIN_MS, self._drain_gui_queue)
+
+    def _show_progress(self, msg):
+        kind = msg[0]
+        if kind == "start":
+            total = max(0, msg[1])
+            self.progress.config(maximum=100, value=0)
+            self.status_var.set(f"Хеширование кандидатов: 0 / {total} (0%)")
+        elif kind == "progress":
+            done, total = msg[1], msg[2]
+            percent = 100 if total <= 0 else int((done / max(1, total)) * 100)
+            percent = 0 if percent < 0 else (100 if percent > 100 else percent)
+            self.progress.config(value=percent, maximum=100)
+            self.status_var.set(f"Хеширование кандидатов: {done} / {total} ({percent}%)")
+
+    def _add_groups(self, groups: List[Group]):
+        new_dups: List[str] = []
+        tree_rows: List[Tuple[Optional[str], tuple]] = []
+        keep_rows: List[Tuple[Optional[str], tuple]] = []
+        add_bytes = 0
+        for group in groups:
             # Сохраняем группу
             self.groups.append(group)
             gindex = len(self.groups)  # 1..N для колонки №
             iid = str(gindex - 1)
 
             # В таблицу сканирования
-            kind = "точн." if group.get("kind") == "exact" else "похож."
-            self.tree.insert("", "end", iid=iid,
-                             values=(gindex, kind, human_size(group["size"]), group["keep"], len(group["others"])))
+            kind = "точн." if group.kind == "exact" else "похож."
+            tree_rows.append((iid, (gindex, kind, human_size(group.size), group.keep, len(group.others))))
 
             # В таблицу оригиналов (№ + путь)
-            self.keep_tree.insert("", "end", values=(gindex, group["keep"]))
+            keep_rows.append((None, (gindex, group.keep)))
 
             # Карта соответствий keep -> dups
-            self.keep_to_dups.setdefault(group["keep"], [])
-            for p in group["others"]:
-                self.keep_to_dups[group["keep"]].append(p)
-
-            # СРАЗУ добавить пути копий в агрегированный список
-            for p in group["others"]:
-                self.others_list.insert(tk.END, p)
-
-            # --- обновление суммарного объёма дубликатов (без двойного учёта)
-            add_bytes = 0
-            for p in group["others"]:
-                if p in self.counted_dups:
-                    continue
-                try:
-                    add_bytes += os.path.getsize(p)
+            self.keep_to_dups.setdefault(group.keep, []).extend(group.others)
+            new_dups.extend(group.others)
+
+            # --- суммарный объём дубликатов (без двойного учёта); размеры
+            # копий уже известны сканеру
+            for p, sz in zip(group.others, group.others_sizes):
+                if p not in self.counted_dups:
+                    add_bytes += sz
                     self.counted_dups.add(p)
-                except Exception:
-                    pass
-            if add_bytes:
-                self.dup_total_bytes += add_bytes
-                self.total_waste_var.set(human_size(self.dup_total_bytes))
-
-        def on_done(elapsed):
-            self.progress.config(value=100, maximum=100)
-            self.btn_scan.config(state="normal")
-            self.btn_stop.config(state="disabled")
-            self.btn_auto.config(state="normal" if self.groups else "disabled")
-            suffix = " (перцептивные недоступны: нет зависимостей)" if self.perceptual_var.get() and not HAS_IMAGEHASH else ""
-            self.status_var.set(
-                f"Готово за {elapsed:.1f} сек. Найдено групп: {len(self.groups)}. Сумма копий: {self.total_waste_var.get()}.{suffix}"
-            )
 
-        # --- запуск сканера ---
-        self.scanner = Scanner(
-            root_folder=root,
-            stop_event=self.stop_event,
-            on_progress=on_progress,
-            on_group=on_group,
-            on_done=on_done,
-            include_masks=include_masks,
-            exclude_masks=exclude_masks,
-            include_exts=include_exts,
-            exclude_exts=exclude_exts,
-            min_size_bytes=min_size_b,
-            perceptual=self.perceptual_var.get(),
-            perceptual_metric=self.perc_metric_var.get(),
-            perceptual_threshold=int(self.perc_thr_var.get()),
-            max_workers=workers,
+        self._bulk_insert(self.tree, tree_rows)
+        self._bulk_insert(self.keep_tree, keep_rows)
+
+        # Пути копий — в агрегированный список одним вызовом Tcl
+        if new_dups:
+            self.others_list.insert(tk.END, *new_dups)
+            for i, p in enumerate(new_dups, self._others_count):
+                self._others_index.setdefault(p, []).append(i)
+            self._others_count += len(new_dups)
+        if add_bytes:
+            self.dup_total_bytes += add_bytes
+            self.total_waste_var.set(human_size(self.dup_total_bytes))
+
+    def _bulk_insert(self, tree: ttk.Treeview, rows: List[Tuple[Optional[str], tuple]]):
+        """Ставит строки в очередь вставки; сами вставки идут порциями в after_idle."""
+        if not rows:
+            return
+        self._bulk_pending.setdefault(tree, []).extend(rows)
+        if self._bulk_job is None:
+            self._bulk_job = self.after_idle(self._bulk_insert_step)
+
+    def _bulk_insert_step(self):
+        self._bulk_job = None
+        for tree, rows in self._bulk_pending.items():
+            chunk = rows[:GUI_INSERT_CHUNK]
+            del rows[:GUI_INSERT_CHUNK]
+            for iid, values in chunk:
+                tree.insert("", "end", iid=iid, values=values)
+        # Между порциями Tk успевает обработать события окна
+        if any(self._bulk_pending.values()):
+            self._bulk_job = self.after_idle(self._bulk_insert_step)
+        else:
+            self.on_table_select()
+
+    def _finish_scan(self, elapsed):
+        self.progress.config(value=100, maximum=100)
+        self.btn_scan.config(state="normal")
+        self.btn_stop.config(state="disabled")
+        self.btn_auto.config(state="normal" if self.groups else "disabled")
+        if elapsed is None:
+            self.status_var.set(f"Сканирование прервано из-за ошибки. Найдено групп: {len(self.groups)}.")
+            return
+        suffix = " (перцептивные недоступны: нет зависимостей)" if self.perceptual_var.get() and not HAS_IMAGEHASH else ""
+        self.status_var.set(
+            f"Готово за {elapsed:.1f} сек. Найдено групп: {len(self.groups)}. Сумма копий: {self.total_waste_var.get()}.{suffix}"
         )
-        self.scanner.start()
 
     def stop_scan(self):
         self.stop_event.set()
         self.status_var.set("Остановка…")
 
+    def _on_close(self):
+        # Процесс-сканер не демонический (ему можно держать свой пул процессов),
+        # поэтому при закрытии окна останавливаем его явно
+        if self.scanner is not None and self.scanner.is_alive():
+            self.stop_event.set()
+            self.scanner.join(timeout=2)
+            if self.scanner.is_alive():
+                self.scanner.terminate()
+        self._close_batch_files()
+        self.destroy()
+
     # Выбор строки в таблице — нужен для кнопки «Разобрать выбранную группу»
     def on_table_select(self, event=None):
+        if self._bulk_job is not None:
+            return  # таблица ещё заполняется; состояние кнопки обновится в конце вставки
         sel = self.tree.selection()
         self.btn_resolve_selected.config(state="normal" if sel else "disabled")
 
     # --- Карантин / логирование / откат ---
-    def ensure_quarantine_batch(self) -> str:
-        root = self.quarantine_root_var.get().strip() or DEFAULT_QUARANTINE_ROOT
-        ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    def ensure_quarantine_batch(self, root: Optional[str] = None) -> str:
+        if root is None:
+            root = self.quarantine_root_var.get().strip() or DEFAULT_QUARANTINE_ROOT
+        ts = time.strftime("%Y-%m-%d_%H-%M-%S")
         dest = os.path.join(root, ts)
         os.makedirs(dest, exist_ok=True)
-        with open(os.path.join(dest, "operations.csv"), "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            w.writerow(["src", "dest", "kind", "hash", "size", "timestamp"])
-        with open(os.path.join(dest, "actions.log"), "a", encoding="utf-8") as f:
-            f.write(f"Batch started at {ts}\n")
+        self._known_present.clear()
+        self._made_dirs.clear()
+        self._open_batch_files(dest)
+        self._batch_log_f.write(f"Batch started at {ts}\n")
         self.last_batch_dir = dest
         return dest
 
+    def _open_batch_files(self, batch_dir: str):
+        """Открывает журналы батча на всё время его жизни (до следующего батча или выхода)."""
+        self._close_batch_files()
+        # Дозапись: батч, созданный в ту же секунду, продолжает тот же журнал, а не затирает его
+        f = open(os.path.join(batch_dir, "operations.csv"), "a", newline="", encoding="utf-8", buffering=1 << 20)
+        w = csv.writer(f)
+        if f.tell() == 0:
+            w.writerow(["src", "dest", "kind", "hash", "size", "timestamp"])
+        self._batch_csv_f, self._batch_csv_w = f, w
+        self._batch_log_f = open(os.path.join(batch_dir, "actions.log"), "a", encoding="utf-8", buffering=1 << 20)
+        self._batch_dir = batch_dir
+
+    def _close_batch_files(self):
+        for f in (self._batch_csv_f, self._batch_log_f):
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        self._batch_csv_f = self._batch_csv_w = self._batch_log_f = None
+        self._batch_dir = None
+
     def log_ops(self, batch_dir: str, ops: List[Tuple[str, str, str, str, int]]):
         if not batch_dir:
             return
-        csv_path = os.path.join(batch_dir, "operations.csv")
-        with open(csv_path, "a", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            now = datetime.now().isoformat(timespec="seconds")
-            for src, dest, kind, hv, sz in ops:
-                w.writerow([src, dest, kind, hv, sz, now])
-        log_path = os.path.join(batch_dir, "actions.log")
-        with open(log_path, "a", encoding="utf-8") as f:
-            for src, dest, kind, hv, sz in ops:
-                f.write(f"{kind}: {src} -> {dest} | {hv} | {sz} bytes\n")
+        if batch_dir != self._batch_dir:
+            self._open_batch_files(batch_dir)
+        # Весь батч — одним writerows и одной записью в лог, без write на каждую операцию
+        now = datetime.now().isoformat(timespec="seconds")
+        self._batch_csv_w.writerows([src, dest, kind, hv, sz, now] for src, dest, kind, hv, sz in ops)
+        self._batch_log_f.write("".join(f"{kind}: {src} -> {dest} | {hv} | {sz} bytes\n" for src, dest, kind, hv, sz in ops))
+        # fsync — один раз на файл после записи батча: журнал отката переживает сбой питания
+        for f in (self._batch_csv_f, self._batch_log_f):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _reserve_path(self, path: str, suffix: str, counter: Optional[Dict[Tuple[str, str], int]] = None) -> str:
+        """Занимает свободное имя: path или «base{suffix.format(n)}ext».
+
+        Имя создаётся атомарно (O_CREAT | O_EXCL) — без os.path.exists на каждый
+        номер. Исходное имя пробуется всегда первым; при коллизии поиск номера
+        продолжается с того, на котором остановился прошлый раз (счётчики — в counter,
+        по умолчанию общие для сессии).
+        """
+        if counter is None:
+            counter = self._name_counter
+        if path not in self._known_present:
+            # Частый случай — имя свободно: одна попытка, без splitext и цикла
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                pass
+        key = (path, suffix)
+        n = counter.get(key, 1)
+        base, ext = os.path.splitext(path)
+        while True:
+            final = f"{base}{suffix.format(n)}{ext}"
+            if final in self._known_present:
+                n += 1
+                continue
+            try:
+                fd = os.open(final, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                n += 1
+                continue
+            os.close(fd)
+            counter[key] = n + 1
+            return final
+
+    @staticmethod
+    def _move_onto(src: str, final: str, same_dev: bool = True):
+        """Переносит src на зарезервированное имя final (пустой файл-заглушку).
+
+        same_dev=False — заранее известно, что диски разные: сразу копирование и
+        удаление, без попытки rename внутри shutil.move.
+        """
+        try:
+            if same_dev:
+                try:
+                    os.replace(src, final)  # тот же диск: одно переименование
+                    return
+                except OSError:
+                    pass
+                shutil.move(src, final)  # rename не вышел — shutil решит сам
+            else:
+                # Другой диск: копирование поверх заглушки, затем удаление оригинала
+                shutil.copy2(src, final, follow_symlinks=False)
+                os.remove(src)
+        except Exception:
+            try:
+                os.remove(final)
+            except OSError:
+                pass
+            raise
 
     def move_to_quarantine(self, src_path: str, quarantine_root: str, scan_root: str) -> str:
         rel = safe_relpath(src_path, scan_root)
         dest_path = os.path.join(quarantine_root, rel)
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-        base, ext = os.path.splitext(dest_path)
-        final = dest_path
-        n = 1
-        while os.path.exists(final):
-            final = f"{base} ({n}){ext}"
-            n += 1
-        shutil.move(src_path, final)
+        d = os.path.dirname(dest_path)
+        if d not in self._made_dirs:
+            os.makedirs(d, exist_ok=True)
+            self._made_dirs.add(d)
+        final = self._reserve_path(dest_path, " ({})")
+        self._move_onto(src_path, final, self._same_device(scan_root, quarantine_root))
+        self._known_present.add(final)
         return final
 
-    def resolve_group(self, group: dict, quarantine_root: Optional[str], delete_instead: bool, scan_root: str) -> List[Tuple[str, str, str, str, int]]:
-        ops = []
-        for p in group["others"]:
+    def _same_device(self, scan_root: str, quarantine_root: str) -> bool:
+        """На одном ли томе папка сканирования и карантин; два stat на пару папок, не на файл."""
+        key = (scan_root, quarantine_root)
+        same = self._same_dev.get(key)
+        if same is None:
+            try:
+                same = os.stat(scan_root).st_dev == os.stat(quarantine_root).st_dev
+            except OSError:
+                same = True  # не знаем — пусть решит попытка os.replace
+            self._same_dev[key] = same
+        return same
+
+    def _resolve_one(self, p: str, sz: Optional[int], group: Group, batch: Optional[_LazyBatch],
+                     delete_instead: bool, scan_root: str) -> Tuple[Tuple[str, str, str, str, int], bool]:
+        """Удаляет или переносит в карантин одну копию: (операция, успех). Вызывается из пула потоков."""
+        if sz is None:
             try:
                 sz = os.path.getsize(p)
             except Exception:
                 sz = 0
+        try:
             if delete_instead:
-                try:
-                    os.remove(p)
-                    ops.append((p, "DELETED", group.get("kind", "exact"), group.get("hash", ""), sz))
-                except Exception as e:
-                    ops.append((p, f"ERROR:{e}", group.get("kind", "exact"), group.get("hash", ""), sz))
-            else:
-                try:
-                    dest = self.move_to_quarantine(p, quarantine_root, scan_root)
-                    ops.append((p, dest, group.get("kind", "exact"), group.get("hash", ""), sz))
-                except Exception as e:
-                    ops.append((p, f"ERROR:{e}", group.get("kind", "exact"), group.get("hash", ""), sz))
-        return ops
+                os.remove(p)
+                return (p, "DELETED", group.kind, group.hash, sz), True
+            # Батч (папка и журналы) создаётся, только если копия действительно
+            # есть; дальше пропажу файла сообщит сам перенос (FileNotFoundError)
+            if not batch.created:
+                os.lstat(p)
+            dest = self.move_to_quarantine(p, batch.path, scan_root)
+            return (p, dest, group.kind, group.hash, sz), True
+        except Exception as e:
+            return (p, f"ERROR:{e}", group.kind, group.hash, sz), False
+
+    def resolve_groups(self, groups: List[Group], batch: Optional[_LazyBatch], delete_instead: bool, scan_root: str) -> Tuple[List[Tuple[str, str, str, str, int]], int]:
+        """Разбирает копии групп; возвращает (операции для журнала, число успешных)."""
+        # Размеры известны со сканирования — отдельный stat нужен только без них
+        jobs = [(p, sz, g)
+                for g in groups
+                for p, sz in zip(g.others, g.others_sizes or (None,) * len(g.others))]
+        workers = max(1, int(self.io_workers_var.get()))
+        if workers == 1 or len(jobs) < 2:
+            results = [self._resolve_one(p, sz, g, batch, delete_instead, scan_root) for p, sz, g in jobs]
+        else:
+            # Перемещения/удаления блокируются на диске, GIL при этом отпущен — выполняем их параллельно.
+            # map сохраняет порядок операций для журнала; журнал пишется потом одним вызовом из потока Tk.
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                results = list(ex.map(lambda job: self._resolve_one(*job, batch, delete_instead, scan_root), jobs))
+        ops, ok = [], 0
+        for op, done in results:
+            ops.append(op)
+            ok += done
+        return ops, ok
+
+    def resolve_group(self, group: Group, batch: Optional[_LazyBatch], delete_instead: bool, scan_root: str) -> Tuple[List[Tuple[str, str, str, str, int]], int]:
+        return self.resolve_groups([group], batch, delete_instead, scan_root)
+
+    def _new_batch(self) -> _LazyBatch:
+        # Корень карантина читается здесь, в потоке Tk; папка создаётся позже, при первом переносе
+        root = self.quarantine_root_var.get().strip() or DEFAULT_QUARANTINE_ROOT
+        return _LazyBatch(lambda: self.ensure_quarantine_batch(root))
+
+    def _set_status_idle(self, text: str):
+        """Статус через after_idle: серия вызовов даёт одно обновление строки."""
+        if self._pending_status is None:
+            self.after_idle(self._flush_status)
+        self._pending_status = text
+
+    def _flush_status(self):
+        if self._pending_status is not None:
+            self.status_var.set(self._pending_status)
+            self._pending_status = None
 
     def auto_resolve_all(self):
         if not self.groups:
@@ -796,19 +1652,14 @@ class App(tk.Tk):
         if delete_instead:
             if not messagebox.askyesno("Подтвердите удаление", "Все копии будут удалены без возможности восстановления. Продолжить?"):
                 return
-        quarantine_root = None if delete_instead else self.ensure_quarantine_batch()
+        batch = None if delete_instead else self._new_batch()
         scan_root = self.root_folder_var.get().strip()
 
-        total_files = sum(len(g["others"]) for g in self.groups)
-        removed = 0
-        all_ops = []
-        for g in self.groups:
-            ops = self.resolve_group(g, quarantine_root, delete_instead, scan_root)
-            removed += sum(1 for _, d, _, _, _ in ops if not str(d).startswith("ERROR"))
-            all_ops.extend(ops)
-        if not delete_instead:
-            self.log_ops(quarantine_root, all_ops)
-        self.status_var.set(f"Готово: убрано копий {removed} из {total_files}.")
+        total_files = sum(len(g.others) for g in self.groups)
+        all_ops, removed = self.resolve_groups(self.groups, batch, delete_instead, scan_root)
+        if batch is not None and batch.created:
+            self.log_ops(batch.path, all_ops)
+        self._set_status_idle(f"Готово: убрано копий {removed} из {total_files}.")
         messagebox.showinfo("Завершено", f"Убрано копий: {removed} из {total_files}.")
 
     def resolve_selected(self):
@@ -817,21 +1668,34 @@ class App(tk.Tk):
             return
         idx = int(sel[0])
         group = self.groups[idx]
-        if not group["others"]:
+        if not group.others:
             messagebox.showinfo("Нет копий", "В выбранной группе нет копий для удаления/перемещения.")
             return
         delete_instead = self.delete_instead_var.get()
         if delete_instead:
             if not messagebox.askyesno("Подтвердите удаление", "Копии будут удалены без возможности восстановления. Продолжить?"):
                 return
-        quarantine_root = None if delete_instead else self.ensure_quarantine_batch()
+        batch = None if delete_instead else self._new_batch()
         scan_root = self.root_folder_var.get().strip()
-        ops = self.resolve_group(group, quarantine_root, delete_instead, scan_root)
-        ok = sum(1 for _, d, _, _, _ in ops if not str(d).startswith("ERROR"))
-        if not delete_instead:
-            self.log_ops(quarantine_root, ops)
-        self.status_var.set(f"Группа разобрана. Убрано копий: {ok} / {len(group['others'])}.")
-        messagebox.showinfo("Готово", f"Убрано копий: {ok} / {len(group['others'])}.")
+        ops, ok = self.resolve_group(group, batch, delete_instead, scan_root)
+        if batch is not None and batch.created:
+            self.log_ops(batch.path, ops)
+        self._set_status_idle(f"Группа разобрана. Убрано копий: {ok} / {len(group.others)}.")
+        messagebox.showinfo("Готово", f"Убрано копий: {ok} / {len(group.others)}.")
+
+    @staticmethod
+    def _report_rows(groups: List[Group]):
+        """Строки CSV-отчёта: заголовок, затем по строке на каждую копию (или одна — для группы без копий)."""
+        yield ["type", "hash", "size_bytes", "keep_path", "others_count", "other_path"]
+        for g in groups:
+            others = g.others
+            if others:
+                # Общая часть строки группы собирается один раз, а не на каждую копию
+                prefix = (g.kind, g.hash, g.size, g.keep, len(others))
+                for other in others:
+                    yield (*prefix, other)
+            else:
+                yield (g.kind, g.hash, g.size, g.keep, 0, "")
 
     def export_csv(self):
         if not self.groups:
@@ -840,20 +1704,12 @@ class App(tk.Tk):
         path = filedialog.asksaveasfilename(title="Сохранить отчёт CSV",
                                             defaultextension=".csv",
                                             filetypes=[("CSV", ".csv")],
-                                            initialfile=f"duplicates_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+                                            initialfile=f"duplicates_report_{time.strftime('%Y%m%d_%H%M%S')}.csv")
         if not path:
             return
         try:
-            with open(path, "w", newline="", encoding="utf-8") as f:
-                w = csv.writer(f)
-                w.writerow(["type", "hash", "size_bytes", "keep_path", "others_count", "other_path"])
-                for g in self.groups:
-                    kind = g.get("kind", "exact")
-                    if g["others"]:
-                        for other in g["others"]:
-                            w.writerow([kind, g.get("hash", ""), g["size"], g["keep"], len(g["others"]), other])
-                    else:
-                        w.writerow([kind, g.get("hash", ""), g["size"], g["keep"], 0, ""])
+            with open(path, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+                csv.writer(f).writerows(self._report_rows(self.groups))
             messagebox.showinfo("Сохранено", f"Отчёт сохранён: {path}")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось сохранить отчёт: {e}")
@@ -863,6 +1719,34 @@ class App(tk.Tk):
         os.makedirs(path, exist_ok=True)
         self._reveal_in_explorer(path)
 
+    def _restore_one(self, src: str, dest: str, counter: Dict[Tuple[str, str], int]) -> Tuple[Optional[bool], str]:
+        """Возвращает файл из карантина: (True, новый путь), (False, "ERROR:…") или (None, "") — файла уже нет.
+
+        Папка исходного файла создаётся, только если её нет и файл в карантине
+        на месте: откат не оставляет пустых папок и не делает лишних makedirs.
+        """
+        if dest not in self._known_present and not os.path.exists(dest):
+            return None, ""
+        try:
+            try:
+                final = self._reserve_path(src, " (restored {})", counter)
+            except FileNotFoundError:
+                if not os.path.exists(dest):
+                    self._known_present.discard(dest)
+                    return None, ""
+                os.makedirs(os.path.dirname(src), exist_ok=True)
+                final = self._reserve_path(src, " (restored {})", counter)
+            self._move_onto(dest, final)
+            self._known_present.discard(dest)
+            return True, final
+        except FileNotFoundError as e:
+            if not os.path.exists(dest):  # файл из карантина убран после записи в журнал
+                self._known_present.discard(dest)
+                return None, ""
+            return False, f"ERROR:{e}"
+        except Exception as e:
+            return False, f"ERROR:{e}"
+
     def undo_last_batch(self):
         default_dir = self.last_batch_dir or (self.quarantine_root_var.get().strip() or DEFAULT_QUARANTINE_ROOT)
         start_dir = default_dir if os.path.isdir(default_dir) else None
@@ -874,25 +1758,42 @@ class App(tk.Tk):
             messagebox.showerror("Нет журнала", "В выбранной папке нет operations.csv — нечего откатывать.")
             return
         restored, errors = 0, 0
-        with open(csv_path, "r", encoding="utf-8") as f:
-            r = csv.DictReader(f)
-            rows = list(r)
-        for row in rows:
-            src = row.get("src")
-            dest = row.get("dest")
-            if dest and dest not in ("DELETED", "") and os.path.exists(dest):
-                try:
-                    os.makedirs(os.path.dirname(src), exist_ok=True)
-                    base, ext = os.path.splitext(src)
-                    final = src
-                    n = 1
-                    while os.path.exists(final):
-                        final = f"{base} (restored {n}){ext}"
-                        n += 1
-                    shutil.move(dest, final)
-                    restored += 1
-                except Exception:
-                    errors += 1
+        workers = max(1, int(self.io_workers_var.get()))
+        now = datetime.now().isoformat(timespec="seconds")
+        # Счётчики «(restored N)» живут только в этом откате: следующий откат снова
+        # начинает с исходных имён, а не с номеров, занятых когда-то раньше
+        restore_counter: Dict[Tuple[str, str], int] = {}
+        # Журнал читается потоково, порциями по UNDO_CHUNK_ROWS строк; порция сортируется
+        # по папке назначения, переносы идут в пуле потоков.
+        # Итог каждой порции — одним writerows в undo.csv, fsync один раз в конце.
+        with open(csv_path, "r", newline="", encoding="utf-8", buffering=1 << 20) as f, \
+                open(os.path.join(batch_dir, "undo.csv"), "a", newline="", encoding="utf-8", buffering=1 << 20) as uf, \
+                ThreadPoolExecutor(max_workers=workers) as ex:
+            undo_w = csv.writer(uf)
+            if uf.tell() == 0:
+                undo_w.writerow(["src", "dest", "restored_to", "timestamp"])
+            entries = ((row["src"], row["dest"])
+                       for row in csv.DictReader(f)
+                       if row.get("src") and row.get("dest")
+                       and row["dest"] != "DELETED" and not row["dest"].startswith("ERROR:"))
+            while True:
+                chunk = list(itertools.islice(entries, UNDO_CHUNK_ROWS))
+                if not chunk:
+                    break
+                chunk.sort(key=lambda sd: os.path.dirname(sd[0]))
+                records = []
+                results = ex.map(lambda sd: self._restore_one(*sd, restore_counter), chunk)
+                for (src, dest), (ok, result) in zip(chunk, results):
+                    if ok is None:
+                        continue
+                    if ok:
+                        restored += 1
+                    else:
+                        errors += 1
+                    records.append([src, dest, result, now])
+                undo_w.writerows(records)
+            uf.flush()
+            os.fsync(uf.fileno())
         messagebox.showinfo("Откат завершён", f"Восстановлено: {restored}. Ошибок: {errors}.")
 
     # --- связка «Оригиналы» -> «Копии» ---
@@ -918,20 +1819,18 @@ class App(tk.Tk):
             self.btn_open_dup_folder.config(state="disabled")
             return
 
-        dups = set(self.keep_to_dups.get(keep_path, []))
+        dups = self.keep_to_dups.get(keep_path)
         if not dups:
             self.btn_open_dup_file.config(state="disabled")
             self.btn_open_dup_folder.config(state="disabled")
             return
 
-        first_idx = None
-        for i in range(self.others_list.size()):
-            if self.others_list.get(i) in dups:
-                self.others_list.selection_set(i)
-                if first_idx is None:
-                    first_idx = i
-        if first_idx is not None:
-            self.others_list.see(first_idx)
+        # Позиции копий берутся из индекса — O(|копии|), а не O(|список|) вызовов Tcl
+        idxs = sorted({i for p in dups for i in self._others_index.get(p, ())})
+        for i in idxs:
+            self.others_list.selection_set(i)
+        if idxs:
+            self.others_list.see(idxs[0])
             self.btn_open_dup_file.config(state="normal")
             self.btn_open_dup_folder.config(state="normal")
 
@@ -969,34 +1868,36 @@ class App(tk.Tk):
         self._reveal_in_explorer(os.path.dirname(path))
 
     # --- helpers ---
-    def _reveal_in_explorer(self, path: str):
+    @staticmethod
+    def _pick_open_cmd():
+        """Команда ОС «открыть путь» (файл — в приложении, папку — в проводнике)."""
+        if sys.platform.startswith("win"):
+            return os.startfile
+        cmd = "open" if sys.platform == "darwin" else "xdg-open"
+        return lambda path: subprocess.Popen([cmd, path])
+
+    def _spawn_open(self, path: str):
+        # Повторный запрос того же пути в течение OPEN_DEBOUNCE_S (двойной клик) игнорируем
+        now = time.monotonic()
+        last = self._recent_opens.get(path)
+        if last is not None and now - last < OPEN_DEBOUNCE_S:
+            return
+        if len(self._recent_opens) >= 32:
+            self._recent_opens = {p: t for p, t in self._recent_opens.items() if now - t < OPEN_DEBOUNCE_S}
+        self._recent_opens[path] = now
         try:
-            if sys.platform.startswith("win"):
-                os.startfile(path)
-            elif sys.platform == "darwin":
-                import subprocess
-                subprocess.Popen(["open", path])
-            else:
-                import subprocess
-                subprocess.Popen(["xdg-open", path])
+            self._open_cmd(path)
         except Exception:
             pass
 
-    def _open_path(self, path: str):
-        try:
-            if sys.platform.startswith("win"):
-                os.startfile(path)
-            elif sys.platform == "darwin":
-                import subprocess
-                subprocess.Popen(["open", path])
-            else:
-                import subprocess
-                subprocess.Popen(["xdg-open", path])
-        except Exception:
-            pass
+    def _reveal_in_explorer(self, path: str):
+        self._spawn_open(path)
 
+    def _open_path(self, path: str):
+        self._spawn_open(path)
 
 def main():
+    multiprocessing.freeze_support()
     app = App()
     app.mainloop()
 